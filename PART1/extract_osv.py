@@ -1,93 +1,130 @@
 #!/usr/bin/env python3
 import os
-import json
 from datetime import datetime, timedelta
-from collections import Counter
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 import csv
 
-def load_osv_jsons(folder, months=12):
-    cutoff_date = datetime.now() - timedelta(days=months*30)
-    ghsa_list, mal_list = [], []
-    for file in os.listdir(folder):
-        if not file.endswith(".json"):
-            continue
-        path = os.path.join(folder, file)
-        with open(path, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Skipping invalid JSON: {file}")
-                continue
-        pub_date = data.get("published")
-        if not pub_date:
-            continue
-        pub_dt = datetime.fromisoformat(pub_date.replace("Z",""))
-        if pub_dt < cutoff_date:
-            continue
-        if file.startswith("GHSA"):
-            ghsa_list.append(data)
-        elif file.startswith("MAL"):
-            mal_list.append(data)
-    return ghsa_list, mal_list
+import orjson
+
+PARQUET_BATCH_ROWS = 10_000
+
+# column order of osv_summary.csv
+Record = namedtuple("Record", "package type cwe severity published summary")
+
+def extract_ghsa_info(g):
+    return Record(
+        package=g['affected'][0]['package']['name'],
+        type="GHSA",
+        cwe=", ".join(g['database_specific'].get('cwe_ids', [])),
+        severity=g['database_specific'].get('severity'),
+        published=g.get('published'),
+        summary=g.get('summary'),
+    )
+
+def extract_mal_info(m):
+    return Record(
+        package=m['affected'][0]['package']['name'],
+        type="MAL",
+        cwe="",
+        severity="",
+        published=m.get('published'),
+        summary=m.get('details'),
+    )
 
-def extract_ghsa_info(ghsa_list):
-    extracted = []
-    for g in ghsa_list:
-        pkg = g['affected'][0]['package']['name']
-        severity = g['database_specific'].get('severity')
-        cwe = ", ".join(g['database_specific'].get('cwe_ids', []))
-        published = g.get('published')
-        summary = g.get('summary')
-        extracted.append({
-            "package": pkg,
-            "type": "GHSA",
-            "cwe": cwe,
-            "severity": severity,
-            "published": published,
-            "summary": summary
-        })
-    return extracted
+def parse_osv_file(path, cutoff_date):
+    # runs in a worker process: only the six Record scalars travel back to the parent
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        try:
+            data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            print(f"Skipping invalid JSON: {name}")
+            return None
+    pub_date = data.get("published")
+    if not pub_date:
+        return None
+    pub_dt = datetime.fromisoformat(pub_date.replace("Z",""))
+    if pub_dt < cutoff_date:
+        return None
+    return extract_ghsa_info(data) if name.startswith("GHSA") else extract_mal_info(data)
 
-def extract_mal_info(mal_list):
-    extracted = []
-    for m in mal_list:
-        pkg = m['affected'][0]['package']['name']
-        published = m.get('published')
-        details = m.get('details')
-        extracted.append({
-            "package": pkg,
-            "type": "MAL",
-            "cwe": "",
-            "severity": "",
-            "published": published,
-            "summary": details
-        })
-    return extracted
+def clearly_before(name, cutoff_date):
+    # MAL-YYYY-NNNN ids carry their allocation year; GHSA ids are random.
+    # File mtimes are not used: they come from whatever the archive stored.
+    if name.startswith("MAL-"):
+        year = name[4:8]
+        return year.isdigit() and int(year) < cutoff_date.year
+    return False
+
+def iter_osv(folder, months=12):
+    cutoff_date = datetime.now() - timedelta(days=months*30)
+    with os.scandir(folder) as it:
+        entries = [e for e in it
+                   if e.name.endswith(".json") and e.name.startswith(("GHSA", "MAL"))]
+    paths = [e.path for e in entries if not clearly_before(e.name, cutoff_date)]
+    print(f"Skipped {len(entries) - len(paths)} of {len(entries)} OSV files as older than the cutoff")
+    with ProcessPoolExecutor() as ex:
+        for res in ex.map(partial(parse_osv_file, cutoff_date=cutoff_date), paths, chunksize=64):
+            if res is not None:
+                yield res
 
 def summarize_and_save(data, output_csv="osv_summary.csv"):
-    keys = ["package", "type", "cwe", "severity", "published", "summary"]
-    with open(output_csv, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=keys)
-        writer.writeheader()
-        for row in data:
-            writer.writerow(row)
-    print(f"Saved summary to {output_csv}")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # typed, compressed mirror of the CSV so the scoring step can skip CSV parsing
+    output_parquet = os.path.splitext(output_csv)[0] + ".parquet"
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([(name, categorical if name in ("type", "severity") else pa.string())
+                        for name in Record._fields])
+    data = iter(data)
+    # records stream in while the files are written, so write to temp files and
+    # only replace the previous summary once every record has been read
+    tmp_csv, tmp_parquet = output_csv + ".tmp", output_parquet + ".tmp"
+    try:
+        # the CSV is closed before the Parquet footer is written, so the mirror is
+        # never older than the CSV (read_summary relies on that mtime order)
+        with pq.ParquetWriter(tmp_parquet, schema, compression="zstd") as pw:
+            with open(tmp_csv, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(Record._fields)
+                while batch := list(islice(data, PARQUET_BATCH_ROWS)):
+                    writer.writerows(batch)
+                    # None becomes "" as in the CSV, so both files read back the same
+                    columns = [["" if v is None else v for v in col] for col in zip(*batch)]
+                    pw.write_table(pa.table(columns, schema=schema))
+    except BaseException:
+        for tmp in (tmp_csv, tmp_parquet):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    os.replace(tmp_csv, output_csv)
+    os.replace(tmp_parquet, output_parquet)
+    print(f"Saved summary to {output_csv} and {output_parquet}")
 
 def main():
     folder = os.path.join(os.getcwd(), "all_json")
-    ghsa_list, mal_list = load_osv_jsons(folder, months=12)
-    ghsa_data = extract_ghsa_info(ghsa_list)
-    mal_data = extract_mal_info(mal_list)
-    all_data = ghsa_data + mal_data
-    summarize_and_save(all_data)
+    totals, cwe_counter, severity_counter = Counter(), Counter(), Counter()
+
+    # quick analysis, tallied as records stream through to the CSV
+    def tally(records):
+        for r in records:
+            totals[r.type] += 1
+            if r.type == "GHSA":
+                if r.cwe:
+                    cwe_counter[r.cwe] += 1
+                if r.severity:
+                    severity_counter[r.severity] += 1
+            yield r
 
-    # quick analysis
-    cwe_counter = Counter([d["cwe"] for d in ghsa_data if d["cwe"]])
-    severity_counter = Counter([d["severity"] for d in ghsa_data if d["severity"]])
+    summarize_and_save(tally(iter_osv(folder, months=12)))
     print("Top CWEs:", cwe_counter.most_common(10))
     print("Severity distribution:", severity_counter)
-    print("Total GHSA:", len(ghsa_data))
-    print("Total MAL:", len(mal_data))
+    print("Total GHSA:", totals["GHSA"])
+    print("Total MAL:", totals["MAL"])
 
 if __name__ == "__main__":
     main()
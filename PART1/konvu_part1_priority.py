@@ -14,29 +14,30 @@ Configurable at top of file:
   - limits for download lookups to avoid long runs (DOWNLOAD_LOOKUP_LIMIT)
 """
 
-import csv
-import json
+import asyncio
 import math
 import os
+import sqlite3
 import time
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
 
-import numpy as np
-import pandas as pd
-import requests
-from sklearn.preprocessing import MinMaxScaler
-import matplotlib.pyplot as plt
+import ahocorasick
+
+# pandas, numpy, httpx and matplotlib are imported inside the functions that
+# use them, so a run only pays for what its config actually needs
 
 # ---------------- CONFIG (edit here to change scoring policy) ----------------
-CSV_FILE = "osv_summary.csv"                  # input (produced by extract script)
+CSV_FILE = "osv_summary.csv"                  # input (produced by extract script; its .parquet mirror is preferred)
 OUT_DIR = "outputs"                           # outputs folder (will be created)
 RANKED_FILE = f"{OUT_DIR}/konvu_ranked.csv"
 REPORT_FILE = f"{OUT_DIR}/osv_analysis_report.txt"
 PNG_FILE = f"{OUT_DIR}/priority_score.png"
-DOWNLOADS_CACHE = "analysis/downloads_cache.json"  # cache location (kept in repo)
+SAVE_SVG = False                              # also write the chart as SVG next to the PNG (vector, smaller)
+CHART_DPI = 120                               # PNG resolution
+DOWNLOADS_CACHE = "analysis/downloads_cache.db"  # SQLite cache location (kept in repo)
+DOWNLOADS_TTL_DAYS = 7       # cached download counts older than this are fetched again
 
 # Scoring weights (must sum to 1; they will be normalized if not)
 W_SEV = 0.60
@@ -45,11 +46,14 @@ W_EXPOSURE = 0.10
 
 TOP_N = 20
 FETCH_DOWNLOADS = True        # set False for fastest run (no network calls)
-THREADS = 8                  # parallel fetch workers
+THREADS = 8                  # concurrent download requests
 DOWNLOAD_TIMEOUT = 3.0       # seconds per request
 MAX_RETRIES = 2
 BACKOFF_BASE = 1.5
+RAMP_UP_STREAK = 10          # consecutive 200s before allowing one more concurrent request
 DOWNLOAD_LOOKUP_LIMIT = 200  # limit how many distinct packages to query downloads for
+DOWNLOADS_API = "https://api.npmjs.org/downloads/point/last-month"
+BULK_BATCH_SIZE = 128        # npm's cap on unscoped packages per bulk downloads query
 
 # Weapon keyword weights (substring matching; higher => more weaponizable)
 WEAP_KEYWORDS = {
@@ -85,78 +89,190 @@ SEV_TO_CVSS = {
 }
 
 # ---------------- helper I/O ----------------
-def read_csv_rows(path):
+SUMMARY_DTYPES = {
+    "package": "string",
+    "type": "category",
+    "cwe": "string",
+    "severity": "category",
+    "published": "string",
+    "summary": "string",
+}
+
+def read_summary(path):
+    import pandas as pd
+
     path = Path(path)
     if not path.exists():
         raise FileNotFoundError(f"{path} not found. Run extract_osv.py first.")
-    rows = []
-    with path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-    return rows
+    # prefer the parquet mirror written alongside the CSV, unless it is stale
+    parquet = path.with_suffix(".parquet")
+    if parquet.exists() and parquet.stat().st_mtime >= path.stat().st_mtime:
+        return pd.read_parquet(parquet).astype(SUMMARY_DTYPES)
+    # keep_default_na=False: empty fields stay "" and package names like "null" survive
+    return pd.read_csv(path, dtype=SUMMARY_DTYPES, keep_default_na=False)
 
 # ---------------- severity parsing ----------------
-def parse_severity_to_cvss(sev_field):
-    if not sev_field:
-        return None
-    s = str(sev_field).strip()
-    try:
-        v = float(s)
-        if 0 <= v <= 10:
-            return v
-    except Exception:
-        pass
-    s_up = s.upper()
-    for k, vv in SEV_TO_CVSS.items():
-        if k in s_up:
-            return vv
-    return None
+def parse_severity_to_cvss(severity):
+    import pandas as pd
+
+    sev = severity.fillna("").astype(str).str.strip()
+    numeric = pd.to_numeric(sev, errors="coerce")
+    numeric = numeric.where(numeric.between(0, 10))
+    return numeric.fillna(sev.str.upper().map(SEV_TO_CVSS)).astype("float64")
 
 # ---------------- weaponization scoring ----------------
-def compute_weapon_score(text):
-    if not text:
-        return 0.0
-    t = text.lower()
-    matched = []
-    for kw, w in WEAP_KEYWORDS.items():
-        if kw in t:
-            matched.append(w)
-    if not matched:
-        return 0.0
-    return min(1.0, max(matched))
+# built once at import; each summary is then scanned in a single pass that
+# reports every (overlapping) keyword hit, like the original substring tests
+WEAP_AUTOMATON = ahocorasick.Automaton()
+for _kw, _w in WEAP_KEYWORDS.items():
+    WEAP_AUTOMATON.add_word(_kw.lower(), _w)
+WEAP_AUTOMATON.make_automaton()
 
-# ---------------- downloads cache + fetching ----------------
-def load_downloads_cache():
-    p = Path(DOWNLOADS_CACHE)
-    if p.exists():
-        try:
-            return json.loads(p.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
+def weapon_score_one(text):
+    return min(1.0, max((w for _, w in WEAP_AUTOMATON.iter(text)), default=0.0))
+
+def compute_weapon_score(summary_lc):
+    # expects already-lowercased text; the automaton holds lowercased keywords
+    return summary_lc.map(weapon_score_one)
 
-def save_downloads_cache(cache):
+# ---------------- downloads cache + fetching ----------------
+def connect_downloads_cache():
     p = Path(DOWNLOADS_CACHE)
     p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(cache, indent=2), encoding="utf-8")
+    con = sqlite3.connect(p)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE IF NOT EXISTS dl(pkg TEXT PRIMARY KEY, dl INTEGER, ts INTEGER)")
+    return con
 
-def fetch_download_count_once(pkg):
-    url = f"https://api.npmjs.org/downloads/point/last-month/{pkg}"
-    attempt = 0
-    while attempt <= MAX_RETRIES:
+def load_downloads_cache():
+    if not Path(DOWNLOADS_CACHE).exists():
+        return {}
+    fresh_after = int(time.time()) - DOWNLOADS_TTL_DAYS * 86400
+    with closing(connect_downloads_cache()) as con:
+        return dict(con.execute("SELECT pkg, dl FROM dl WHERE ts > ?", (fresh_after,)))
+
+def save_downloads_cache(counts):
+    now = int(time.time())
+    with closing(connect_downloads_cache()) as con, con:
+        con.executemany("INSERT OR REPLACE INTO dl(pkg, dl, ts) VALUES (?, ?, ?)",
+                        [(p, n, now) for p, n in counts.items()])
+
+class AimdLimiter:
+    """Concurrency gate for the npm API: one request at a time after a 429, +1 per streak of 200s."""
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.ok_streak = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    async def throttled(self):
+        async with self.cond:
+            self.limit = max(1, self.limit // 2)
+            self.ok_streak = 0
+
+    async def rate_limited(self):
+        # hammering a 429ing API only makes it worse, so serialize until it recovers
+        async with self.cond:
+            self.limit = 1
+            self.ok_streak = 0
+
+    async def succeeded(self):
+        async with self.cond:
+            self.ok_streak += 1
+            if self.ok_streak >= RAMP_UP_STREAK and self.limit < self.max_limit:
+                self.limit += 1
+                self.ok_streak = 0
+                self.cond.notify_all()
+
+def retry_after_seconds(headers, attempt):
+    try:
+        return max(0.0, float(headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return (BACKOFF_BASE ** attempt) * 0.5
+
+async def get_downloads_json(client, limiter, names):
+    """GET the downloads endpoint for `names`; {} for unknown packages, None if the API kept failing."""
+    import httpx
+
+    url = f"{DOWNLOADS_API}/{','.join(names)}"
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            r = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
-            if r.status_code == 200:
-                return int(r.json().get("downloads", 0))
-            if r.status_code == 429:
-                time.sleep((BACKOFF_BASE ** attempt) * 0.5)
+            async with limiter:
+                r = await client.get(url)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # the transport has already retried the connect MAX_RETRIES times
+            return None
+        except httpx.HTTPError:
+            await asyncio.sleep((BACKOFF_BASE ** attempt) * 0.3)
+            continue
+        if r.status_code == 200:
+            if r.headers.get("X-RateLimit-Remaining") == "0":
+                await limiter.throttled()
             else:
-                return 0
-        except Exception:
-            time.sleep((BACKOFF_BASE ** attempt) * 0.3)
-        attempt += 1
-    return 0
+                await limiter.succeeded()
+            try:
+                return r.json()
+            except ValueError:
+                return None
+        if r.status_code == 429:
+            await limiter.rate_limited()
+            await asyncio.sleep(retry_after_seconds(r.headers, attempt))
+        elif r.status_code >= 500:
+            await asyncio.sleep((BACKOFF_BASE ** attempt) * 0.3)
+        else:
+            # 404 and other client errors will not change on retry
+            return {}
+    return None
+
+async def fetch_download_count_once(client, limiter, pkg):
+    body = await get_downloads_json(client, limiter, [pkg])
+    if body is None:
+        return None
+    return int(body.get("downloads", 0))
+
+async def fetch_download_counts_bulk(client, limiter, batch):
+    # bulk responses map each name to its point record, or null for unknown packages
+    body = await get_downloads_json(client, limiter, batch)
+    if body is None:
+        return dict.fromkeys(batch)
+    return {p: int((body.get(p) or {}).get("downloads", 0)) for p in batch}
+
+async def fetch_all(pkgs, threads):
+    import httpx
+
+    # npm only serves unscoped packages in bulk, and a one-name "bulk" query
+    # answers in the single-package shape, so those go one by one
+    plain = [p for p in pkgs if not p.startswith("@")]
+    batches = [plain[i:i + BULK_BATCH_SIZE] for i in range(0, len(plain), BULK_BATCH_SIZE)]
+    singles = [p for p in pkgs if p.startswith("@")]
+    if batches and len(batches[-1]) == 1:
+        singles += batches.pop()
+    # one pooled HTTP/2 client for the whole run; the limiter adapts in-flight requests
+    limiter = AimdLimiter(threads)
+    # keep-alive pool sized to the concurrency cap; failed connects are retried by the transport
+    limits = httpx.Limits(max_connections=threads, max_keepalive_connections=threads)
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=MAX_RETRIES)
+    async with httpx.AsyncClient(transport=transport, timeout=DOWNLOAD_TIMEOUT) as client:
+        results = await asyncio.gather(
+            *(fetch_download_counts_bulk(client, limiter, b) for b in batches),
+            *(fetch_download_count_once(client, limiter, p) for p in singles),
+        )
+    fetched = dict(zip(singles, results[len(batches):]))
+    for part in results[:len(batches)]:
+        fetched.update(part)
+    return fetched
 
 def fetch_downloads_parallel(pkgs, threads=THREADS, limit=DOWNLOAD_LOOKUP_LIMIT):
     cache = load_downloads_cache()
@@ -167,61 +283,80 @@ def fetch_downloads_parallel(pkgs, threads=THREADS, limit=DOWNLOAD_LOOKUP_LIMIT)
     if not to_fetch:
         return {p: cache.get(p, 0) for p in pkgs}
     print(f"[INFO] Fetching downloads for {len(to_fetch)} packages (parallel {threads}) — first run may take some time")
-    with ThreadPoolExecutor(max_workers=threads) as ex:
-        futures = {ex.submit(fetch_download_count_once, p): p for p in to_fetch}
-        for fut in as_completed(futures):
-            p = futures[fut]
-            try:
-                val = fut.result()
-            except Exception:
-                val = 0
-            cache[p] = val
-    save_downloads_cache(cache)
+    fetched = asyncio.run(fetch_all(to_fetch, threads))
+    # failed lookups stay out of the cache so the next run retries them
+    fetched = {p: n for p, n in fetched.items() if n is not None}
+    save_downloads_cache(fetched)
+    cache.update(fetched)
     return {p: cache.get(p, 0) for p in pkgs}
 
 # ---------------- core scoring pipeline ----------------
-def score_rows(rows, w_sev, w_exploit, w_exposure, fetch_downloads):
-    ghsa_rows = [r for r in rows if r.get("type","").upper() == "GHSA"]
-    if not ghsa_rows:
-        return pd.DataFrame()
-    df = pd.DataFrame(ghsa_rows)
-    df["summary"] = df.get("summary","").fillna("")
+def score_rows(summary_df, w_sev, w_exploit, w_exposure, fetch_downloads):
+    import numpy as np
+    import pandas as pd
+
+    types = summary_df["type"].str.upper()
+    ghsa = summary_df[types.eq("GHSA")]
+    mal = summary_df[types.eq("MAL")]
+    if ghsa.empty:
+        return pd.DataFrame(), ghsa, mal
+    df = ghsa.copy()
+    df["summary"] = df["summary"].fillna("")
+    # case-fold once here so the keyword automaton can match case-sensitively
+    summary_lc = df["summary"].str.lower()
 
     # severity -> numeric CVSS
-    df["cvss_raw"] = df["severity"].apply(parse_severity_to_cvss)
-    median_cvss = np.nanmedian(df["cvss_raw"].astype(float)) if not df["cvss_raw"].isnull().all() else 5.5
-    df["cvss"] = df["cvss_raw"].fillna(median_cvss)
+    cvss_raw = parse_severity_to_cvss(df["severity"])
+    cvss = cvss_raw.to_numpy(dtype=np.float32, na_value=np.nan)
+    missing = np.isnan(cvss)
+    median_cvss = float(np.median(cvss[~missing])) if not missing.all() else 5.5
+    cvss[missing] = median_cvss
 
     # weaponization score
-    df["weap_score"] = df["summary"].apply(compute_weapon_score)
+    weap_score = compute_weapon_score(summary_lc)
+    weap = weap_score.to_numpy(dtype=np.float32)
 
     # downloads/exposure (limit to top packages by frequency to keep time bounded)
     pkgs = list(df["package"].value_counts().index)  # ordered by frequency
     downloads_map = {p: 0 for p in pkgs}
     if fetch_downloads and pkgs:
         downloads_map = fetch_downloads_parallel(pkgs)
-
-    df["downloads"] = df["package"].map(downloads_map).fillna(0)
-    df["downloads_log"] = df["downloads"].apply(lambda x: math.log1p(x))
-
-    # normalize axes
-    scaler = MinMaxScaler()
-    norm_cols = df[["cvss", "weap_score", "downloads_log"]].astype(float).fillna(0)
-    scaled = scaler.fit_transform(norm_cols)
-    df[["sev_norm", "weap_norm", "exp_norm"]] = scaled
-
-    # combined score
-    df["score"] = w_sev * df["sev_norm"] + w_exploit * df["weap_norm"] + w_exposure * df["exp_norm"]
+    downloads = df["package"].map(downloads_map).fillna(0).to_numpy(dtype=np.int64)
+    downloads_log = np.log1p(downloads)
+
+    # normalize the three axes and combine them in one float32 pass
+    axes = np.empty((len(df), 3), dtype=np.float32)
+    axes[:, 0] = cvss
+    axes[:, 1] = weap
+    axes[:, 2] = downloads_log
+    lo = axes.min(axis=0)
+    hi = axes.max(axis=0)
+    axes -= lo
+    axes /= np.where(hi > lo, hi - lo, 1.0).astype(np.float32)
+    score = axes @ np.array([w_sev, w_exploit, w_exposure], dtype=np.float32)
+
+    # attach as float64 so konvu_ranked.csv keeps its columns and number format
+    df["cvss_raw"] = cvss_raw
+    df["cvss"] = cvss.astype(np.float64)
+    df["weap_score"] = weap_score
+    df["downloads"] = downloads
+    df["downloads_log"] = downloads_log
+    df[["sev_norm", "weap_norm", "exp_norm"]] = axes.astype(np.float64)
+    df["score"] = score.astype(np.float64)
 
     # aggregate per package (take highest scoring advisory per package)
     agg = df.sort_values("score", ascending=False).groupby("package", as_index=False).first()
     agg = agg.sort_values("score", ascending=False)
-    return agg
+    return agg, ghsa, mal
 
 # ---------------- outputs ----------------
-def generate_outputs(rows, w_sev, w_exploit, w_exposure, top_n, fetch_downloads, ranked_file, report_file, png_file):
+def generate_outputs(summary_df, w_sev, w_exploit, w_exposure, top_n, fetch_downloads, ranked_file, report_file, png_file):
+    import matplotlib
+    matplotlib.use("Agg")  # file output only; skip GUI backend auto-detection
+    import matplotlib.pyplot as plt
+
     Path(OUT_DIR).mkdir(parents=True, exist_ok=True)
-    agg = score_rows(rows, w_sev, w_exploit, w_exposure, fetch_downloads)
+    agg, ghsa, mal = score_rows(summary_df, w_sev, w_exploit, w_exposure, fetch_downloads)
     if agg.empty:
         print("[WARN] No GHSA entries found in CSV")
         return
@@ -232,33 +367,27 @@ def generate_outputs(rows, w_sev, w_exploit, w_exposure, top_n, fetch_downloads,
     plt.barh(top["package"].iloc[::-1], top["score"].iloc[::-1])
     plt.xlabel("Priority score (0-1)")
     plt.title(f"Konvu priority short-list (top {top_n})")
-    plt.tight_layout()
-    plt.savefig(png_file, dpi=300)
+    plt.savefig(png_file, dpi=CHART_DPI, bbox_inches="tight")
+    if SAVE_SVG:
+        plt.savefig(Path(png_file).with_suffix(".svg"), bbox_inches="tight")
     plt.close()
 
-    ghsa = [r for r in rows if r.get("type","").upper() == "GHSA"]
-    mal = [r for r in rows if r.get("type","").upper() == "MAL"]
-    cwe_counter = Counter()
-    for r in ghsa:
-        for c in (r.get("cwe") or "").split(","):
-            c = c.strip()
-            if c:
-                cwe_counter[c] += 1
-    severity_counter = Counter([r.get("severity") or "UNKNOWN" for r in ghsa])
-    mal_counter = Counter([r.get("package") for r in mal])
+    cwe_counts = ghsa["cwe"].str.split(",").explode().str.strip().loc[lambda c: c != ""].value_counts()
+    severity_counts = ghsa["severity"].astype("string").replace("", "UNKNOWN").value_counts()
+    mal_counts = mal["package"].value_counts()
 
     with open(report_file, "w", encoding="utf-8") as f:
         f.write("JavaScript OSV snapshot — automated analysis (last 12 months)\n\n")
         f.write(f"Total GHSA entries: {len(ghsa)}\n")
         f.write(f"Total MAL entries: {len(mal)}\n\n")
         f.write("Top CWEs (GHSA):\n")
-        for k, v in cwe_counter.most_common(12):
+        for k, v in cwe_counts.head(12).items():
             f.write(f"  {k}: {v}\n")
         f.write("\nSeverity distribution (GHSA):\n")
-        for k, v in severity_counter.most_common():
+        for k, v in severity_counts.items():
             f.write(f"  {k}: {v}\n")
         f.write("\nTop MAL packages (sample):\n")
-        for k, v in mal_counter.most_common(10):
+        for k, v in mal_counts.head(10).items():
             f.write(f"  {k}: {v}\n")
         f.write("\nTop Konvu ranked short-list (package, score, severity, downloads):\n")
         for _, r in top.iterrows():
@@ -267,7 +396,7 @@ def generate_outputs(rows, w_sev, w_exploit, w_exposure, top_n, fetch_downloads,
         f.write(" - Treat packages scoring in top 5 or score >= 0.80 as P0 — immediate triage and hotfix.\n")
         f.write(" - Focus on RCE/SQLi/Prototype Pollution/SSRF variants first; they have highest exploitability.\n")
         f.write(" - Track MAL packages with downloads closely; if maintainer changes or sudden publish spikes occur, block.\n")
-        f.write(" - Automate this pipeline and re-run monthly; keep downloads_cache.json alongside repo.\n")
+        f.write(" - Automate this pipeline and re-run monthly; keep downloads_cache.db alongside repo.\n")
 
     print(f"[OK] Wrote: {ranked_file}, {png_file}, {report_file}")
 
@@ -282,8 +411,8 @@ def main():
     else:
         w_sev, w_exploit, w_exposure = W_SEV, W_EXPLOIT, W_EXPOSURE
 
-    rows = read_csv_rows(CSV_FILE)
-    generate_outputs(rows, w_sev, w_exploit, w_exposure, TOP_N, FETCH_DOWNLOADS, RANKED_FILE, REPORT_FILE, PNG_FILE)
+    summary_df = read_summary(CSV_FILE)
+    generate_outputs(summary_df, w_sev, w_exploit, w_exposure, TOP_N, FETCH_DOWNLOADS, RANKED_FILE, REPORT_FILE, PNG_FILE)
 
 if __name__ == "__main__":
     main()
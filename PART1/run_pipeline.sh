@@ -16,7 +16,7 @@ source .venv/bin/activate
 # 3️⃣ Install required Python packages
 echo "[*] Installing required Python packages..."
 pip install --upgrade pip
-pip install pandas requests tqdm numpy matplotlib seaborn scikit-learn
+pip install pandas "httpx[http2]" tqdm numpy matplotlib seaborn orjson pyarrow pyahocorasick
 
 # 4️⃣ Run extraction script
 echo "[*] Extracting OSV data..."
@@ -28,10 +28,10 @@ python konvu_part1_priority.py
 
 # 6️⃣ Move all outputs to /outputs
 mkdir -p outputs
-mv osv_summary.csv konvu_ranked.csv priority_score.png osv_analysis_report.txt outputs/
+mv osv_summary.csv osv_summary.parquet konvu_ranked.csv priority_score.png osv_analysis_report.txt outputs/
 
 echo "[*] Pipeline finished! Outputs:"
-echo " - Summary CSV: osv_summary.csv"
+echo " - Summary CSV: osv_summary.csv (+ osv_summary.parquet)"
 echo " - Ranked CSV: konvu_ranked.csv"
 echo " - Priority chart: priority_score.png"
 echo " - Report: osv_analysis_report.txt"